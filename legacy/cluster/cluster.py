@@ -9,10 +9,11 @@ from __future__ import print_function, absolute_import
 
 import csv
 import fnmatch
+import heapq
 import logging
 import os
 import random
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from math import asin, sin, acos, sqrt
 
 import matplotlib
@@ -25,7 +26,10 @@ from matplotlib import pylab as plt
 from matplotlib.lines import Line2D
 from mpl_toolkits.basemap import Basemap
 import click
-from obspy import read_events
+from lxml import etree
+from obspy import read_events, UTCDateTime
+from obspy.core.event import (Event, Origin, Arrival, Pick, Comment,
+                              WaveformStreamID, ResourceIdentifier)
 from obspy.geodetics import locations2degrees, gps2dist_azimuth
 from obspy.geodetics.base import WGS84_A as RADIUS
 from seismic.traveltime import pslog
@@ -33,6 +37,16 @@ from seismic import mpiops
 import ellipcorr
 from seismic.inventory.parse_inventory import read_all_stations
 
+# Use the faster multi-threaded pyarrow csv reader if available. pyarrow is
+# also required for parquet gather output.
+try:
+    import pyarrow
+    from pyarrow import csv as pa_csv
+    from pyarrow import parquet as pa_parquet
+except ImportError:
+    pyarrow = pa_csv = pa_parquet = None
+# end try
+
 DPI = asin(1.0) / 90.0
 R2D = 90. / asin(1.)
 FLOAT_FORMAT = '%.4f'
@@ -52,6 +66,37 @@ column_names = ['source_block', 'station_block',
                 'source_depth', STATION_LONGITUDE, STATION_LATITUDE,
                 'observed_tt', 'locations2degrees', STATION_CODE, 'SNR', 'P_or_S']
 
+# columns of the arrivals written by the gather stage, which carry the pick and
+# origin times and the ellipticity correction in place of observed_tt
+gather_column_names = column_names[:9] + \
+    ['pick_time', 'origin_time', 'ellipticity_corr'] + column_names[10:]
+
+# explicit column types used when reading arrivals files back in, so pandas
+# skips type inference. Floats are kept at double precision as they are
+# passed on to the inversion.
+column_dtypes = {'source_block': np.int64, 'station_block': np.int64,
+                 'residual': np.float64, 'event_number': np.int64,
+                 SOURCE_LONGITUDE: np.float64, SOURCE_LATITUDE: np.float64,
+                 'source_depth': np.float64, STATION_LONGITUDE: np.float64,
+                 STATION_LATITUDE: np.float64, 'observed_tt': np.float64,
+                 'locations2degrees': np.float64, STATION_CODE: str,
+                 'SNR': np.float64, 'P_or_S': np.int8}
+
+# column types of the gather output. The pick and origin times are read as
+# the text written by obspy UTCDateTime and parsed afterwards.
+gather_column_dtypes = dict(
+    [(c, column_dtypes[c]) for c in gather_column_names if c in column_dtypes],
+    pick_time=str, origin_time=str, ellipticity_corr=np.float64)
+
+# number of rows read at a time from the (potentially huge) gather output
+CHUNK_SIZE = 1000000
+
+# maximum rows per row group of the parquet gather output
+PARQUET_ROW_GROUP_SIZE = 50000
+
+# prefix obspy gives SC3ML publicIDs that are not already QuakeML ids
+SC3ML_ID_PREFIX = 'smi:org.gfz.de/geofon/'
+
 # since we have Basemap in the virtualenv, let's just use that :)
 ANZ = Basemap(llcrnrlon=100.0, llcrnrlat=-50.0,
               urcrnrlon=190.0, urcrnrlat=0.0)
@@ -154,6 +199,23 @@ class Grid:
 
         return int(block_number)
 
+    def find_block_numbers(self, lat, lon, z):
+        """
+        Vectorised version of `find_block_number`.
+        :param lat: numpy array of lattitudes
+        :param lon: numpy array of longitudes
+        :param z: elevation, scalar or numpy array
+        :return: numpy array of int block numbers
+        """
+        y = 90. - np.asarray(lat)
+        x = np.asarray(lon) % 360
+        i = np.round(x / self.dx) + 1
+        j = np.round(y / self.dy) + 1
+        k = np.round(np.asarray(z) / self.dz) + 1
+        block_number = (k - 1) * self.nx * self.ny + (j - 1) * self.nx + i
+
+        return block_number.astype(np.int64)
+
 class Grid2:
     """
     A non-uniform Grid Model for source->events rays clustering and sorting.
@@ -282,6 +344,38 @@ class Grid2:
 
         return int(block_number)
 
+    def find_block_numbers(self, lat, lon, z):
+        """
+        Vectorised version of `find_block_number`, mapping arrays of points
+        to their block numbers in one pass.
+        :param lat: numpy array of latitudes
+        :param lon: numpy array of longitudes
+        :param z: depth, scalar or numpy array
+        :return: numpy array of int block numbers
+        """
+        lat = np.asarray(lat)
+        z = np.asarray(z)
+        x = np.asarray(lon) % 360  # convert lon into x which must be in [0,360)
+        y = 90. - lat  # convert lat into y which will be in [0,180)
+
+        in_region = (lat <= self.LAT[1]) & (lat >= self.LAT[0]) & \
+                    (x <= self.LON[1]) & (x >= self.LON[0])
+
+        i = np.round(x / self.dx) + 1
+        j = np.round(y / self.dy) + 1
+        k = np.round(z / self.dz) + 1
+        block_number = (k - 1) * self.nx * self.ny + (j - 1) * self.nx + i
+
+        gi = np.round(x / self.gdx) + 1
+        gj = np.round(y / self.gdy) + 1
+        gk = np.round(z / self.gdz) + 1
+        g_block_number = (gk - 1) * self.gnx * self.gny + (gj - 1) * self.gnx + gi
+
+        block_number = np.where(in_region, block_number,
+                                g_block_number + self.REGION_MAX_BN)
+
+        return block_number.astype(np.int64)
+
 
 @click.group()
 @click.option('-v', '--verbosity',
@@ -352,12 +446,19 @@ def get_paths_from_csv(csvfile):
               type=click.Choice(['P S', 'Pn Sn', 'Pg Sg', 'p s']),
               default='P S',
               help='Wave type pair to generate inversion inputs')
-def gather(events_dir, output_file, nx, ny, dz, wave_type):
+@click.option('-f', '--file_format',
+              type=click.Choice(['csv', 'parquet']), default='csv',
+              help='Output format of the gathered arrivals. parquet output '
+                   'requires pyarrow')
+def gather(events_dir, output_file, nx, ny, dz, wave_type, file_format):
     """
     Gather all source-station block pairs for all events in a list of directory.
     """
     log.info("Gathering all arrivals")
 
+    if file_format == 'parquet' and pa_parquet is None:
+        raise ImportError('pyarrow is required for parquet output')
+
     if os.path.isfile(events_dir):  # is a text csv file containing multiple dirs.
         event_dirs = get_paths_from_csv(events_dir)
         event_xmls = recursive_glob(event_dirs)
@@ -373,7 +474,8 @@ def gather(events_dir, output_file, nx, ny, dz, wave_type):
     # generate the stations dict
     stations = mpiops.run_once(read_all_stations)
 
-    process_many_events(event_xmls, grid, stations, wave_type, output_file)
+    process_many_events(event_xmls, grid, stations, wave_type, output_file,
+                        file_format=file_format)
 
     log.info('Gathered all arrivals in process {}'.format(mpiops.rank))
 
@@ -381,12 +483,17 @@ def gather(events_dir, output_file, nx, ny, dz, wave_type):
 
     if mpiops.rank == 0:
         log.info('Now joining all arrivals')
-        for t in wave_type.split() + ['missing_stations',
-                                      'participating_stations']:
+        for t in wave_type.split():
+            _gather_all(output_file, t, file_format)
+        for t in ['missing_stations', 'participating_stations']:
             _gather_all(output_file, t)
 
 
-def _gather_all(output_file, s_type):
+def _gather_all(output_file, s_type, file_format='csv'):
+    if file_format == 'parquet':
+        _gather_all_parquet(output_file, s_type)
+        return
+
     final_s_file = output_file + '_' + s_type + '.csv'
     s_arrs = []
     for r in range(mpiops.size):
@@ -403,107 +510,368 @@ def _gather_all(output_file, s_type):
             pass
 
 
+def _gather_all_parquet(output_file, s_type):
+    final_s_file = output_file + '_' + s_type + '.parquet'
+    s_files = [output_file + '_' + s_type + '_{}.parquet'.format(r)
+               for r in range(mpiops.size)]
+    table = pyarrow.concat_tables([pa_parquet.read_table(f) for f in s_files])
+    pa_parquet.write_table(table, final_s_file, compression='zstd',
+                           row_group_size=PARQUET_ROW_GROUP_SIZE)
+    for f in s_files:
+        os.remove(f)
+
+
+def _gather_schema():
+    """
+    :return: pyarrow.Schema of the arrivals written by the gather stage
+    """
+    types = {c: pyarrow.from_numpy_dtype(t) for c, t in column_dtypes.items()
+             if t is not str}
+    types['pick_time'] = types['origin_time'] = pyarrow.timestamp('us')
+    types['ellipticity_corr'] = pyarrow.float64()
+    types[STATION_CODE] = pyarrow.string()
+    return pyarrow.schema([(c, types[c]) for c in gather_column_names])
+
+
 class ArrivalWriter:
     """
-    Convenience class for writing arrival data
+    Convenience class for writing arrival data.
+
+    Arrivals are buffered in memory and flushed to the output files in
+    batches with pandas, instead of one csv row at a time. With parquet
+    output each flush of the P and S arrivals is written as a row group.
     """
 
-    def __init__(self, rank, wave_type, output_file):
+    def __init__(self, rank, wave_type, output_file, batch_size=1000,
+                 file_format='csv'):
+        """
+        :param rank: int
+            process rank used to name the output files
+        :param wave_type: str
+            Wave type pair, eg, 'P S'
+        :param output_file: str
+            output arrivals file basename
+        :param batch_size: int
+            number of buffered `write` calls (event files) before the
+            arrivals are flushed to disk
+        :param file_format: str
+            'csv' or 'parquet', format of the P and S arrivals files. The
+            station lists are always written as csv.
+        """
         p_type, s_type = wave_type.split()
-        p_file = output_file + '_' + p_type + '_{}.csv'.format(rank)
-        s_file = output_file + '_' + s_type + '_{}.csv'.format(rank)
+        ext = '_{}.' + file_format
+        p_file = output_file + '_' + p_type + ext.format(rank)
+        s_file = output_file + '_' + s_type + ext.format(rank)
         miss_st_file = output_file + '_missing_stations_{}.csv'.format(rank)
         st_file = output_file + '_participating_stations_{}.csv'.format(rank)
 
-        self.p_handle = open(p_file, 'w')
-        self.s_handle = open(s_file, 'w')
+        self.file_format = file_format
+        if file_format == 'parquet':
+            self._schema = _gather_schema()
+            self.p_handle = pa_parquet.ParquetWriter(p_file, self._schema,
+                                                     compression='zstd')
+            self.s_handle = pa_parquet.ParquetWriter(s_file, self._schema,
+                                                     compression='zstd')
+        else:
+            self.p_handle = open(p_file, 'w')
+            self.s_handle = open(s_file, 'w')
         self.miss_st_handle = open(miss_st_file, 'w')
         self.st_handle = open(st_file, 'w')
 
-        self.p_writer = csv.writer(self.p_handle)
-        self.s_writer = csv.writer(self.s_handle)
-        self.missing_st_writer = csv.writer(self.miss_st_handle)
-        self.st_writer = csv.writer(self.st_handle)
+        self.batch_size = batch_size
+        self._pending = 0
+        self._p_rows = []
+        self._s_rows = []
+        self._missing_stations = []
+        self._arr_stations = []
 
     def write(self, cluster_info):
-        log.info("Writing cluster info to output file in process {}".format(
-            mpiops.rank))
-
         p_arr, s_arr, missing_stations, arr_stations = cluster_info
-        for p in p_arr:
-            self.p_writer.writerow(p)
-        for s in s_arr:
-            self.s_writer.writerow(s)
+        self._p_rows += p_arr
+        self._s_rows += s_arr
+        self._missing_stations += missing_stations
+        self._arr_stations += arr_stations
 
-        for st in missing_stations:
-            self.missing_st_writer.writerow([st])
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        log.info("Writing cluster info to output file in process {}".format(
+            mpiops.rank))
 
-        for st in arr_stations:
-            self.st_writer.writerow([st])
+        parquet = self.file_format == 'parquet'
+        for rows, handle, as_table in [
+                (self._p_rows, self.p_handle, parquet),
+                (self._s_rows, self.s_handle, parquet),
+                (self._missing_stations, self.miss_st_handle, False),
+                (self._arr_stations, self.st_handle, False)]:
+            if not rows:
+                continue
+            if as_table:
+                handle.write_table(self._to_table(rows),
+                                   row_group_size=PARQUET_ROW_GROUP_SIZE)
+            else:
+                pd.DataFrame(rows).to_csv(handle, header=False, index=False)
+            del rows[:]
+        self._pending = 0
+
+    def _to_table(self, rows):
+        df = pd.DataFrame(rows, columns=gather_column_names)
+        for c in ['pick_time', 'origin_time']:
+            df[c] = [t.datetime for t in df[c]]  # obspy UTCDateTime
+        return pyarrow.Table.from_pandas(df, schema=self._schema,
+                                         preserve_index=False)
 
     def close(self):
-        if mpiops.rank == 0:
-            self.p_handle.close()
-            self.s_handle.close()
-            self.miss_st_handle.close()
-            self.st_handle.close()
+        self.flush()
+        self.p_handle.close()
+        self.s_handle.close()
+        self.miss_st_handle.close()
+        self.st_handle.close()
 
 
 def process_many_events(event_xmls, grid, stations, wave_type, output_file,
-                        seed=1):
+                        seed=1, file_format='csv'):
     total_events = len(event_xmls)
 
     # when event xmls are of unequal complexity, this shuffle helps
     # distribute the workload evenly amongst processes
     random.seed(seed)
     random.shuffle(event_xmls)
-    p_event_xmls = mpiops.array_split(event_xmls, mpiops.rank)
+    p_event_xmls = _split_by_size(event_xmls, mpiops.size)[mpiops.rank]
 
     log.info('Processing {} events of total {} using process {}'.format(
         len(p_event_xmls), total_events, mpiops.rank))
 
     arrival_writer = ArrivalWriter(mpiops.rank, wave_type=wave_type,
-                                   output_file=output_file)
+                                   output_file=output_file,
+                                   file_format=file_format)
     process_event_counter = 0
 
     for i, xml in enumerate(p_event_xmls):
         if xml is not None:
-            p_arr = []
-            s_arr = []
-            missing_stations = []
-            arriving_stations = []
             log.info('Reading event file {xml}: {i} of {files} in process'
                      ' {process}'.format(i=i + 1, files=len(p_event_xmls),
                                          xml=os.path.basename(xml),
                                          process=mpiops.rank))
-            # one event xml could contain multiple events
-            try:
-                for e in read_events(xml).events:
-                    process_event_counter += 1
-                    p_arr_t, s_arr_t, m_st, a_st = process_event(
-                        e, stations, grid, wave_type, process_event_counter)
-                    p_arr += p_arr_t
-                    s_arr += s_arr_t
-                    missing_stations += m_st
-                    arriving_stations += a_st
-
-                    log.debug('processed event {e} from {xml}'.format(
-                        e=e.resource_id, xml=xml))
-            except ValueError as e:
-                log.warning('ValueError in processing event {}'.format(xml))
-                log.warning(e)
-            except Exception as e:
-                log.warning('Unknown Exception in '
-                            'processing event {}'.format(xml))
-                log.warning(e)
-
-            arrival_writer.write([p_arr, s_arr, missing_stations,
-                                  arriving_stations])
+            cluster_info, process_event_counter = process_event_file(
+                xml, stations, grid, wave_type, process_event_counter)
+            arrival_writer.write(cluster_info)
 
     log.info('Read all events in process {}'.format(mpiops.rank))
     arrival_writer.close()
 
 
+def _split_by_size(event_xmls, n_parts):
+    """
+    Split the event xmls into n_parts lists of roughly equal total file size.
+    The file size is a good proxy for the number of arrivals, and therefore
+    the work, in each file. Files are handed out largest first to the
+    currently least loaded part.
+
+    :param event_xmls: list of paths to event xml files
+    :param n_parts: int, number of processes to split the files across
+    :return: list of n_parts lists of paths
+    """
+    sizes = [os.path.getsize(xml) for xml in event_xmls]
+    # stable sort, so files of equal size keep their shuffled order
+    order = sorted(range(len(event_xmls)), key=lambda i: -sizes[i])
+    parts = [[] for _ in range(n_parts)]
+    loads = [(0, r) for r in range(n_parts)]
+    for i in order:
+        load, r = heapq.heappop(loads)
+        parts[r].append(event_xmls[i])
+        heapq.heappush(loads, (load + sizes[i], r))
+    return parts
+
+
+def process_event_file(xml, stations, grid, wave_type, counter):
+    """
+    Read a single events xml file and process all the events in it. Only
+    one file's catalog is held in memory at any time.
+
+    :param xml: str
+        path to the events xml file
+    :param stations: dict
+        stations dict
+    :param grid: Grid class instance
+    :param wave_type: str
+        Wave type pair to generate inversion inputs. See `gather` function.
+    :param counter: int
+        number of events processed so far in this process
+    :return: ([p_arr, s_arr, missing_stations, arriving_stations], counter)
+    """
+    p_arr = []
+    s_arr = []
+    missing_stations = []
+    arriving_stations = []
+    # one event xml could contain multiple events
+    try:
+        for e in _read_events(xml):
+            counter += 1
+            p_arr_t, s_arr_t, m_st, a_st = process_event(
+                e, stations, grid, wave_type, counter)
+            p_arr += p_arr_t
+            s_arr += s_arr_t
+            missing_stations += m_st
+            arriving_stations += a_st
+
+            log.debug('processed event {e} from {xml}'.format(
+                e=e.resource_id, xml=xml))
+    except ValueError as e:
+        log.warning('ValueError in processing event {}'.format(xml))
+        log.warning(e)
+    except Exception as e:
+        log.warning('Unknown Exception in '
+                    'processing event {}'.format(xml))
+        log.warning(e)
+
+    return [p_arr, s_arr, missing_stations, arriving_stations], counter
+
+
+def _read_events(xml):
+    """
+    :param xml: str
+        path to the events xml file
+    :return: list of obspy.core.event.Event
+    """
+    if _is_sc3ml(xml):
+        return read_sc3ml_events(xml)
+    return read_events(xml).events
+
+
+def _is_sc3ml(xml):
+    # only the root element is parsed, from a file closed on return
+    with open(xml, 'rb') as f:
+        _, root = next(etree.iterparse(f, events=('start',)))
+        return _local_name(root) == 'seiscomp'
+
+
+def _local_name(elem):
+    return etree.QName(elem).localname
+
+
+def _text(elem, *path):
+    """
+    Text of the descendant of `elem` at the path of local names, eg,
+    ('time', 'value'), or None if it is not present.
+    """
+    for name in path:
+        for child in elem:
+            if _local_name(child) == name:
+                elem = child
+                break
+        else:
+            return None
+    return elem.text
+
+
+def _float(text):
+    return None if text is None else float(text)
+
+
+def _sc3ml_id(public_id):
+    """
+    Convert an SC3ML publicID to the resource id obspy gives it.
+    """
+    if public_id is None or public_id.startswith(('smi:', 'quakeml:')):
+        return public_id
+    return SC3ML_ID_PREFIX + public_id.replace(' ', '_').replace(':', '_')
+
+
+def read_sc3ml_events(xml):
+    """
+    Read the events of a SeisComP3 (SC3ML) xml file, populating only the
+    event attributes used by `process_event`.
+
+    obspy's read_events transforms the whole SC3ML document into QuakeML with
+    XSLT before parsing it. Here the picks, origins and events are instead
+    stream parsed with lxml, and each element is discarded once read. As in
+    obspy's conversion, origin depths are converted from km to m, and each
+    event holds the origins it references and the picks of their arrivals.
+
+    :param xml: str
+        path to the SC3ML events xml file
+    :return: list of obspy.core.event.Event
+    """
+    picks = {}
+    origins = {}
+    events = []
+    for _, elem in etree.iterparse(xml, events=('end',)):
+        parent = elem.getparent()
+        if parent is None or _local_name(parent) != 'EventParameters':
+            continue
+        tag = _local_name(elem)
+        if tag == 'pick':
+            pick = _sc3ml_pick(elem)
+            picks[pick.resource_id.id] = pick
+        elif tag == 'origin':
+            origin = _sc3ml_origin(elem)
+            origins[origin.resource_id.id] = origin
+        elif tag == 'event':
+            origin_ids = [_sc3ml_id(c.text) for c in elem
+                          if _local_name(c) == 'originReference']
+            events.append((_sc3ml_id(elem.get('publicID')), origin_ids,
+                           _sc3ml_id(_text(elem, 'preferredOriginID'))))
+        # free the parsed element and any already read siblings
+        elem.clear()
+        while elem.getprevious() is not None:
+            del parent[0]
+
+    catalog = []
+    for event_id, origin_ids, preferred_origin_id in events:
+        ev_origins = [origins[o] for o in origin_ids if o in origins]
+        # unique pick ids, in arrival order
+        pick_ids = list(OrderedDict.fromkeys(
+            arr.pick_id.id for origin in ev_origins for arr in origin.arrivals))
+        ev_picks = [picks[p] for p in pick_ids if p in picks]
+        catalog.append(Event(
+            resource_id=ResourceIdentifier(event_id),
+            origins=ev_origins, picks=ev_picks,
+            preferred_origin_id=preferred_origin_id
+            if preferred_origin_id in origin_ids else None))
+    return catalog
+
+
+def _sc3ml_pick(elem):
+    waveform_id = WaveformStreamID()
+    comments = []
+    for child in elem:
+        tag = _local_name(child)
+        if tag == 'waveformID':
+            waveform_id = WaveformStreamID(
+                network_code=child.get('networkCode'),
+                station_code=child.get('stationCode'),
+                location_code=child.get('locationCode'),
+                channel_code=child.get('channelCode'))
+        elif tag == 'comment':
+            comments.append(Comment(text=_text(child, 'text'),
+                                    force_resource_id=False))
+    time = _text(elem, 'time', 'value')
+    pick_id = ResourceIdentifier(_sc3ml_id(elem.get('publicID')))
+    return Pick(resource_id=pick_id,
+                time=None if time is None else UTCDateTime(time),
+                waveform_id=waveform_id, comments=comments)
+
+
+def _sc3ml_origin(elem):
+    arrivals = [Arrival(pick_id=ResourceIdentifier(
+                            _sc3ml_id(_text(c, 'pickID'))),
+                        phase=_text(c, 'phase'),
+                        time_residual=_float(_text(c, 'timeResidual')))
+                for c in elem if _local_name(c) == 'arrival']
+    time = _text(elem, 'time', 'value')
+    depth = _float(_text(elem, 'depth', 'value'))
+    origin_id = ResourceIdentifier(_sc3ml_id(elem.get('publicID')))
+    return Origin(resource_id=origin_id,
+                  time=None if time is None else UTCDateTime(time),
+                  latitude=_float(_text(elem, 'latitude', 'value')),
+                  longitude=_float(_text(elem, 'longitude', 'value')),
+                  depth=None if depth is None else depth * 1000.0,
+                  arrivals=arrivals)
+
+
 def process_event(event, stations, grid, wave_type, counter):
     """
     :param event: obspy.core.event.Event class instance
@@ -516,6 +884,7 @@ def process_event(event, stations, grid, wave_type, counter):
         event counter in this process
     """
     p_type, s_type = wave_type.split()
+    phases = frozenset((p_type, s_type))
 
     # use preferred origin timestamp as the event number
     # if preferred origin is not populated, use the first origin timestamp
@@ -548,13 +917,21 @@ def process_event(event, stations, grid, wave_type, counter):
 
     event_block = grid.find_block_number(ev_latitude, ev_longitude, z=ev_depth)
 
+    # look up picks by id, rather than resolving each arrival's pick_id
+    # through get_referred_object several times
+    picks = {p.resource_id.id: p for p in event.picks}
+
+    # collect the arrivals recorded at known stations, so that distances and
+    # station blocks can be computed for the whole event at once
+    arrivals = []
     for arr in origin.arrivals:
 
-        snr_value = getSNR(arr)
+        pick = picks.get(arr.pick_id.id)
+
+        snr_value = getSNR(pick)
         log.debug("Arrival Pick SNR value: %s", snr_value)
 
-        sta_code = arr.pick_id.get_referred_object(
-        ).waveform_id.station_code
+        sta_code = pick.waveform_id.station_code
 
         # ignore arrivals not in stations dict, workaround for now for
         # ENGDAHL/ISC events
@@ -566,21 +943,35 @@ def process_event(event, stations, grid, wave_type, counter):
         # Note some stations are still missing even after taking into account
         #  of all seiscomp3 stations, ISC and ENGDAHL stations
         if sta_code not in stations:
-            log.warning('Station {} not found in inventory'.format(sta_code))
             missing_stations.append(str(sta_code))
             continue
-        sta = stations[sta_code]
+        arrivals.append((arr, pick, sta_code, stations[sta_code], snr_value))
 
-        log.debug("events and station latlong: %s, %s, %s, %s", ev_latitude, ev_longitude,
-                                              sta.latitude, sta.longitude)
+    # report the missing stations once per event, not once per arrival
+    if missing_stations:
+        log.warning('%d arrivals at stations not found in inventory: %s',
+                    len(missing_stations),
+                    ', '.join(sorted(set(missing_stations))))
 
-        try:
-            degrees_to_source = locations2degrees(ev_latitude, ev_longitude,
-                                              sta.latitude,
-                                              sta.longitude)
-        except Exception as e:
-            log.warning("location to degree error %s", e )
+    if not arrivals:
+        return p_arrivals, s_arrivals, missing_stations, arrival_staions
+
+    sta_lats = np.array([sta.latitude for _, _, _, sta, _ in arrivals])
+    sta_lons = np.array([sta.longitude for _, _, _, sta, _ in arrivals])
 
+    # locations2degrees accepts numpy arrays
+    degrees = locations2degrees(ev_latitude, ev_longitude,
+                                sta_lats, sta_lons).tolist()
+
+    # TODO: use station.elevation information
+    station_blocks = grid.find_block_numbers(sta_lats, sta_lons,
+                                             z=0.0).tolist()
+
+    for (arr, pick, sta_code, sta, snr_value), degrees_to_source, station_block in \
+            zip(arrivals, degrees, station_blocks):
+
+        log.debug("events and station latlong: %s, %s, %s, %s", ev_latitude, ev_longitude,
+                                              sta.latitude, sta.longitude)
         log.debug("location to degree= %s", degrees_to_source)
         # ignore stations more than 90 degrees from source
         if degrees_to_source > 90.0:
@@ -588,18 +979,16 @@ def process_event(event, stations, grid, wave_type, counter):
             #          'is {} degrees'.format(degrees_to_source))
             continue
 
-        # TODO: use station.elevation information
-        station_block = grid.find_block_number(sta.latitude, sta.longitude, z=0.0)
-
-        if arr.phase in wave_type.split():
+        phase = arr.phase
+        if phase in phases:
             log.debug("Began ellipticity_corr ")
 
             azim_v = gps2dist_azimuth(ev_latitude, ev_longitude, sta.latitude, sta.longitude)[1]
 
-            log.debug("Check input params to ellipticity_corr = %s, %s, %s, %s, %s", arr.phase, degrees_to_source, ev_depth, 90-ev_latitude, azim_v )
+            log.debug("Check input params to ellipticity_corr = %s, %s, %s, %s, %s", phase, degrees_to_source, ev_depth, 90-ev_latitude, azim_v )
 
             ellipticity_corr = ellipcorr.ellipticity_corr(
-                phase=arr.phase,
+                phase=phase,
                 edist=degrees_to_source,
                 edepth=ev_depth / 1000.0,
                 # TODO: check co-latitude definition
@@ -616,11 +1005,11 @@ def process_event(event, stations, grid, wave_type, counter):
                       ev_longitude, ev_latitude, ev_depth,
                       sta.longitude, sta.latitude,
                       #(arr.pick_id.get_referred_object().time.timestamp - origin.time.timestamp) + ellipticity_corr,
-                      arr.pick_id.get_referred_object().time,  origin.time,  ellipticity_corr,
+                      pick.time,  origin.time,  ellipticity_corr,
                       degrees_to_source,
                       sta_code, snr_value]
             arrival_staions.append(sta_code)
-            p_arrivals.append(t_list + [1]) if arr.phase == p_type else \
+            p_arrivals.append(t_list + [1]) if phase == p_type else \
                 s_arrivals.append(t_list + [2])
         else:  # ignore the other phases
             pass
@@ -636,14 +1025,14 @@ def process_event(event, stations, grid, wave_type, counter):
 #     block_number = (k - 1) * grid.nx * grid.ny + (j - 1) * grid.nx + i
 #     return int(block_number)
 
-def getSNR(arrival):
+def getSNR(pick):
     """
-    From the arrival get the SNR value.
+    From the arrival's pick get the SNR value.
     This algorithm depend on how the snr value is coded in the xml file
-    :param arrival:
+    :param pick: obspy.core.event.Pick referred to by the arrival
     :return: a float SNR value
     """
-    snr_v = arrival.pick_id.get_referred_object().comments[3]  # Comment(text='snr = 10.7157568852')
+    snr_v = pick.comments[3]  # Comment(text='snr = 10.7157568852')
 
     snrlist = str(snr_v).split("snr =")
     snrv = snrlist[-1][:-2]  # the last item of the split, trimming two chars ')
@@ -672,9 +1061,11 @@ def sort(output_file, sorted_file, residual_cutoff):
     cmdline usage:
     cluster sort outfile_P.csv 5. -s sorted_P.csv
     cluster sort outfile_S.csv 10. -s sorted_S.csv
+    cluster sort outfile_P.parquet 5. -s sorted_P.csv
 
 
-    :param output_file: output file from the gather stage (eg, outfile_P.csv)
+    :param output_file: output file from the gather stage (eg, outfile_P.csv
+        or outfile_P.parquet)
     :param sorted_file: str, optional
         optional sorted output file path. Default: sorted.csv.
     :param residual_cutoff: float
@@ -684,10 +1075,12 @@ def sort(output_file, sorted_file, residual_cutoff):
 
     log.info('Filtering arrivals.')
 
-    cluster_data = pd.read_csv(output_file, header=None,
-                               names=column_names)
-    cluster_data = cluster_data[abs(cluster_data['residual'])
-                                < residual_cutoff]
+    if output_file.name.endswith('.parquet'):
+        cluster_data = _read_gathered_parquet(output_file.name,
+                                              residual_cutoff)
+    else:
+        cluster_data = _read_gathered_csv(output_file, residual_cutoff)
+    cluster_data[STATION_CODE] = cluster_data[STATION_CODE].astype('category')
     cluster_data['source_depth'] = cluster_data['source_depth'] / 1000.0  # scale meter to KM
     # groupby sorts by default
     # cluster_data.sort_values(by=['source_block', 'station_block'],
@@ -695,14 +1088,14 @@ def sort(output_file, sorted_file, residual_cutoff):
 
     log.info('Sorting arrivals.')
 
-    # groupby automatically sorts
-    med = cluster_data.groupby(by=['source_block',
-                                   'station_block'])[
-        'observed_tt'].quantile(q=.5, interpolation='lower').reset_index()
+    # broadcast the (lower) median observed_tt of each block pair back onto
+    # its rows, and keep the rows that match it
+    med = cluster_data.groupby(by=['source_block', 'station_block'])[
+        'observed_tt'].transform('quantile', q=.5, interpolation='lower')
 
-    final_df = pd.merge(cluster_data, med, how='right',
-                        on=['source_block', 'station_block', 'observed_tt'],
-                        sort=True, right_index=True)
+    # stable sort keeps the original row order within each block pair
+    final_df = cluster_data[cluster_data['observed_tt'] == med].sort_values(
+        by=['source_block', 'station_block'], kind='mergesort')
 
     # Confirmed: drop_duplicates required due to possibly duplicated picks in
     #  the original engdahl events
@@ -791,6 +1184,90 @@ def sort2(output_file, sorted_file, residual_cutoff):
     return final_df
 
 
+def _read_gathered_csv(csv_file, residual_cutoff, chunksize=CHUNK_SIZE):
+    """
+    Read the arrivals of a csv gather output, keeping those with absolute
+    residual below `residual_cutoff`. The filter is applied chunk by chunk,
+    so rejected arrivals are never all held in memory.
+
+    :param csv_file: file handle or path of the csv gather output
+    :param residual_cutoff: float
+    :param chunksize: int, number of rows read at a time
+    :return: pandas.DataFrame with columns `column_names`
+    """
+    arrivals = pd.concat(
+        chunk[abs(chunk['residual']) < residual_cutoff]
+        for chunk in pd.read_csv(csv_file, header=None,
+                                 names=gather_column_names,
+                                 dtype=gather_column_dtypes,
+                                 chunksize=chunksize))
+    return _to_sort_columns(arrivals)
+
+
+def _read_gathered_parquet(parquet_file, residual_cutoff):
+    """
+    Read the arrivals of a parquet gather output, keeping those with absolute
+    residual below `residual_cutoff`. The filter is pushed down to the parquet
+    reader, so row groups without any such arrivals are skipped.
+
+    :param parquet_file: str, path of the parquet gather output
+    :param residual_cutoff: float
+    :return: pandas.DataFrame with columns `column_names`
+    """
+    arrivals = pd.read_parquet(parquet_file, engine='pyarrow',
+                               filters=[('residual', '<', residual_cutoff),
+                                        ('residual', '>', -residual_cutoff)])
+    return _to_sort_columns(arrivals)
+
+
+def _to_sort_columns(arrivals):
+    """
+    Convert gathered arrivals to the sorted arrivals columns, computing
+    observed_tt from the pick and origin times plus the ellipticity
+    correction.
+
+    :param arrivals: pandas.DataFrame with columns `gather_column_names`.
+        The pick and origin times are either obspy UTCDateTime text (csv
+        gather output) or timestamps (parquet gather output).
+    :return: pandas.DataFrame with columns `column_names`
+    """
+    # dividing by one second, rather than total_seconds, gives the same
+    # travel times whatever the resolution of the parsed times
+    travel_time = (pd.to_datetime(arrivals['pick_time']) -
+                   pd.to_datetime(arrivals['origin_time'])) / \
+        np.timedelta64(1, 's')
+    arrivals['observed_tt'] = travel_time + arrivals['ellipticity_corr']
+    return arrivals[column_names]
+
+
+def _read_arrivals(arrivals_file, sep=','):
+    """
+    Read a whole arrivals file with columns `column_names` and no header.
+    The multi-threaded pyarrow csv reader is used when pyarrow is installed,
+    otherwise pandas.
+
+    :param arrivals_file: file handle or path of the arrivals file
+    :param sep: str, column delimiter
+    :return: pandas.DataFrame with `column_dtypes` types and categorical
+        station codes
+    """
+    dtypes = dict(column_dtypes, **{STATION_CODE: 'category'})
+    if pa_csv is None:
+        return pd.read_csv(arrivals_file, header=None, names=column_names,
+                           sep=sep, dtype=dtypes)
+
+    column_types = {c: pyarrow.from_numpy_dtype(t)
+                    for c, t in column_dtypes.items() if t is not str}
+    column_types[STATION_CODE] = pyarrow.dictionary(pyarrow.int32(),
+                                                    pyarrow.string())
+    table = pa_csv.read_csv(
+        getattr(arrivals_file, 'name', arrivals_file),
+        read_options=pa_csv.ReadOptions(column_names=column_names),
+        parse_options=pa_csv.ParseOptions(delimiter=sep),
+        convert_options=pa_csv.ConvertOptions(column_types=column_types))
+    return table.to_pandas()
+
+
 @cli.command()
 @click.argument('p_file', type=click.File(mode='r'))
 @click.argument('s_file', type=click.File(mode='r'))
@@ -821,17 +1298,16 @@ def match(p_file, s_file, matched_p_file, matched_s_file):
 
     log.info('Matching p and s arrivals')
 
-    p_arr = pd.read_csv(p_file, header=None, names=column_names, sep=' ')
-    s_arr = pd.read_csv(s_file, header=None, names=column_names, sep=' ')
-
-    blocks = pd.merge(p_arr[['source_block', 'station_block']],
-                      s_arr[['source_block', 'station_block']],
-                      how='inner',
-                      on=['source_block', 'station_block'])
-    matched_P = pd.merge(p_arr, blocks, how='inner',
-                         on=['source_block', 'station_block'])[column_names]
-    matched_S = pd.merge(s_arr, blocks, how='inner',
-                         on=['source_block', 'station_block'])[column_names]
+    p_arr = _read_arrivals(p_file, sep=' ')
+    s_arr = _read_arrivals(s_file, sep=' ')
+
+    # select the rows of the source-station block pairs present in both,
+    # rather than merging the wide tables against the common pairs
+    p_blocks = pd.MultiIndex.from_frame(p_arr[['source_block', 'station_block']])
+    s_blocks = pd.MultiIndex.from_frame(s_arr[['source_block', 'station_block']])
+    blocks = p_blocks.intersection(s_blocks)
+    matched_P = p_arr.loc[p_blocks.isin(blocks), column_names]
+    matched_S = s_arr.loc[s_blocks.isin(blocks), column_names]
     matched_P.to_csv(matched_p_file, index=False, header=False, sep=' ')
     matched_S.to_csv(matched_s_file, index=False, header=False, sep=' ')
 
@@ -1,5 +1,4 @@
 from __future__ import absolute_import, print_function
-import csv
 import struct
 from os.path import join, dirname
 import logging
@@ -157,16 +156,20 @@ def read_stations(station_file):
         dict of stations indexed by station_code for quick lookup
     """
     log.info('Reading seiscomp3 exported stations file')
-    stations_dict = {}
-    with open(station_file, 'r') as csv_file:
-        reader = csv.reader(csv_file)
-        next(reader)  # skip header
-        for sta in reader:
-            stations_dict[sta[0]] = Station(
-                sta[0], float(sta[1]), float(sta[2]), float(sta[3]), sta[4]
-            )
-        log.info('Done reading seiscomp3 station files')
-        return stations_dict
+    # the first five columns hold the Station fields; the header is skipped
+    # rather than used, and station codes like NA are not read as missing
+    df = pd.read_csv(station_file, header=None, skiprows=1, usecols=range(5),
+                     names=Station._fields,
+                     dtype={'station_code': str, 'latitude': float,
+                            'longitude': float, 'elevation': float,
+                            'network_code': str},
+                     keep_default_na=False)
+    # tolist gives python floats, as the csv reader loop used to
+    stations = map(Station._make,
+                   zip(*(df[f].tolist() for f in Station._fields)))
+    stations_dict = {sta.station_code: sta for sta in stations}
+    log.info('Done reading seiscomp3 station files')
+    return stations_dict
 
 # =====================================================
 # How to test run python inventory/parse_inventory.py
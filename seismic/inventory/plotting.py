@@ -6,9 +6,11 @@ import os
 import sys
 import pandas as pd
 from seismic.inventory.pdconvert import pd2Network
+from seismic.inventory.table_format import TABLE_COLUMNS
 from obspy.core.inventory import Inventory
 import matplotlib.pyplot as plt
 from collections import defaultdict
+from multiprocessing import Pool
 
 if sys.version_info[0] < 3:
     import pathlib2 as pathlib  # pylint: disable=import-error
@@ -17,8 +19,112 @@ else:
 
 no_instruments = defaultdict(lambda: None)
 
+# Channel level stationtxt header, as written by obspy
+STATIONTXT_HEADER = ("#Network|Station|Location|Channel|Latitude|Longitude|Elevation|Depth|Azimuth|Dip|"
+                     "SensorDescription|Scale|ScaleFreq|ScaleUnits|SampleRate|StartTime|EndTime")
 
-def saveNetworkLocalPlots(df, plot_folder, progressor=None, include_stations_list=True):
+
+def _writeStationTxt(data, inv_fname):
+    """
+    Write channel level stationtxt file of station records directly from the dataframe, matching the output of
+    obspy's stationtxt writer for the Network returned by pd2Network with no instrument responses.
+
+    :param data: Dataframe of station records of a single network.
+    :type data: pandas.DataFrame conforming to table_format.TABLE_SCHEMA
+    :param inv_fname: Name of output file
+    :type inv_fname: str
+    """
+    # pd2Network orders stations by station code, keeping the channel order within each station
+    data = data.sort_values('StationCode', kind='mergesort')
+    stations = data.groupby('StationCode', sort=False)
+    table = pd.DataFrame({'Network': data['NetworkCode'], 'Station': data['StationCode'], 'Location': '',
+                          'Channel': data['ChannelCode']})
+    for col in ['Latitude', 'Longitude', 'Elevation']:
+        # obspy falls back to the station coordinate where the channel coordinate is zero
+        table[col] = data[col].where(data[col] != 0, stations[col].transform('first')).astype(float)
+    table['Depth'] = 0.0
+    table['Azimuth'] = 0.0
+    table['Dip'] = -90.0
+    for col in ['SensorDescription', 'Scale', 'ScaleFreq', 'ScaleUnits', 'SampleRate']:
+        table[col] = ''
+    table['StartTime'] = pd.to_datetime(data['ChannelStart']).dt.strftime("%Y-%m-%dT%H:%M:%S")
+    table['EndTime'] = pd.to_datetime(data['ChannelEnd']).dt.strftime("%Y-%m-%dT%H:%M:%S")
+    lines = table.to_csv(sep='|', header=False, index=False, na_rep='')
+    with open(inv_fname, 'w') as f:
+        f.write(STATIONTXT_HEADER + "\n" + lines.rstrip("\n"))
+
+
+def _initPlotWorker():
+    """
+    Use the non-interactive Agg backend in plotting worker processes, as plots are only written to file.
+    """
+    plt.switch_backend('Agg')
+
+
+def _saveLocalPlot(args):
+    """
+    Save visual map plot, and optionally stationtxt file, of one group of station records.
+
+    :param args: Tuple of (name, netcode, data, dest_path, include_stations_list), where name is the base file
+        name of the output files and data the station records of the group.
+    :type args: tuple
+    :return: Tuple of group name, number of records in the group and whether plotting succeeded
+    :rtype: tuple(str, int, bool)
+    """
+    name, netcode, data, dest_path, include_stations_list = args
+    net = pd2Network(netcode, data, no_instruments)
+    plot_fname = os.path.join(dest_path, name + ".png")
+    success = True
+    try:
+        net.plot(projection="local", resolution="l", outfile=plot_fname, continent_fill_color="#e0e0e0", water_fill_color="#d0d0ff", color="#c08080")
+    except:
+        success = False
+    finally:
+        # The local projection is fitted to each group's stations, so figures cannot be reused between groups.
+        # Close them all, including any left open by a failed plot, so they don't accumulate in the worker.
+        plt.close('all')
+
+    if include_stations_list:
+        inv_fname = os.path.join(dest_path, name + ".txt")
+        if set(TABLE_COLUMNS).issubset(data.columns):
+            _writeStationTxt(data, inv_fname)
+        else:
+            inv = Inventory(networks=[net], source='EHB')
+            inv.write(inv_fname, format="stationtxt")
+
+    return name, len(data), success
+
+
+def _saveLocalPlots(groups, dest_path, progressor, include_stations_list, processes):
+    """
+    Save visual map plots of groups of station records, in this process or in parallel over a pool of worker
+    processes.
+
+    :param groups: Iterable of (name, netcode, data) tuples, one per plot.
+    :type groups: iterable
+    :param processes: Number of worker processes to plot with. If 1, plots are made in this process.
+    :type processes: int or None
+    :return: Names of the groups that failed to plot
+    :rtype: list(str)
+    """
+    failed = []
+    tasks = ((name, netcode, data, dest_path, include_stations_list) for name, netcode, data in groups)
+    pool = None if processes == 1 else Pool(processes, initializer=_initPlotWorker)
+    try:
+        results = (_saveLocalPlot(t) for t in tasks) if pool is None else pool.imap_unordered(_saveLocalPlot, tasks)
+        for name, count, success in results:
+            if not success:
+                failed.append(name)
+            if progressor:
+                progressor(count)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return sorted(failed)
+
+
+def saveNetworkLocalPlots(df, plot_folder, progressor=None, include_stations_list=True, processes=1):
     """
     Save visual map plot per network, saved to file netcode.png.
 
@@ -30,26 +136,14 @@ def saveNetworkLocalPlots(df, plot_folder, progressor=None, include_stations_lis
     :param progressor: Callable object receiving incremental update on progress, optional
     :param include_stations_list: If True, also export stationtxt file alongside each png file, defaults to True
     :param include_stations_list: bool, optional
+    :param processes: Number of worker processes to plot with, defaults to 1, which plots in this process.
+        None uses the number of CPUs.
+    :type processes: int, optional
     """
     dest_path = os.path.join(plot_folder, "networks")
     pathlib.Path(dest_path).mkdir(parents=True, exist_ok=True)
-    failed = []
-    for netcode, data in df.groupby('NetworkCode'):
-        net = pd2Network(netcode, data, no_instruments)
-        plot_fname = os.path.join(dest_path, netcode + ".png")
-        try:
-            fig = net.plot(projection="local", resolution="l", outfile=plot_fname, continent_fill_color="#e0e0e0", water_fill_color="#d0d0ff", color="#c08080")
-            plt.close(fig)
-        except:
-            failed.append(netcode)
-
-        if include_stations_list:
-            inv = Inventory(networks=[net], source='EHB')
-            inv_fname = os.path.join(dest_path, netcode + ".txt")
-            inv.write(inv_fname, format="stationtxt")
-
-        if progressor:
-            progressor(len(data))
+    groups = ((netcode, netcode, data) for netcode, data in df.groupby('NetworkCode'))
+    failed = _saveLocalPlots(groups, dest_path, progressor, include_stations_list, processes)
     if failed:
         print("FAILED plotting on the following networks:")
         print("\n".join(failed))
@@ -57,7 +151,7 @@ def saveNetworkLocalPlots(df, plot_folder, progressor=None, include_stations_lis
         print("SUCCESS!")
 
 
-def saveStationLocalPlots(df, plot_folder, progressor=None, include_stations_list=True):
+def saveStationLocalPlots(df, plot_folder, progressor=None, include_stations_list=True, processes=1):
     """
     Save visual map plot per station, saved to file netcode.stationcode.png.
 
@@ -69,27 +163,15 @@ def saveStationLocalPlots(df, plot_folder, progressor=None, include_stations_lis
     :param progressor: Callable object receiving incremental update on progress, optional
     :param include_stations_list: If True, also export stationtxt file alongside each png file, defaults to True
     :param include_stations_list: bool, optional
+    :param processes: Number of worker processes to plot with, defaults to 1, which plots in this process.
+        None uses the number of CPUs.
+    :type processes: int, optional
     """
     dest_path = os.path.join(plot_folder, "stations")
     pathlib.Path(dest_path).mkdir(parents=True, exist_ok=True)
-    failed = []
-    for (netcode, statcode), data in df.groupby(['NetworkCode', 'StationCode']):
-        net = pd2Network(netcode, data, no_instruments)
-        station_name = ".".join([netcode, statcode])
-        plot_fname = os.path.join(dest_path, station_name + ".png")
-        try:
-            fig = net.plot(projection="local", resolution="l", outfile=plot_fname, continent_fill_color="#e0e0e0", water_fill_color="#d0d0ff", color="#c08080")
-            plt.close(fig)
-        except:
-            failed.append(station_name)
-
-        if include_stations_list:
-            inv = Inventory(networks=[net], source='EHB')
-            inv_fname = os.path.join(dest_path, station_name + ".txt")
-            inv.write(inv_fname, format="stationtxt")
-
-        if progressor:
-            progressor(len(data))
+    groups = ((".".join([netcode, statcode]), netcode, data)
+              for (netcode, statcode), data in df.groupby(['NetworkCode', 'StationCode']))
+    failed = _saveLocalPlots(groups, dest_path, progressor, include_stations_list, processes)
     if failed:
         print("FAILED plotting on the following stations:")
         print("\n".join(failed))
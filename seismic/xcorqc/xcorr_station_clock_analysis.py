@@ -7,16 +7,14 @@ and plotting in standard layout.
 
 import os
 import sys
-import datetime
 import time
 import gc
 import glob
 
+from multiprocessing import Pool
 from textwrap import wrap
 
 import numpy as np
-import scipy
-from scipy import signal
 import pandas as pd
 import matplotlib.dates
 import matplotlib.pyplot as plt
@@ -29,6 +27,26 @@ from seismic.ASDFdatabase import FederatedASDFDataSet
 from analytic_plot_utils import distance
 from tqdm.auto import tqdm
 
+# Use the faster nan-aware reductions from the bottleneck module if available
+try:
+    from bottleneck import nanmax, nanmean, nanstd
+except ImportError:
+    from numpy import nanmax, nanmean, nanstd
+# end try
+
+# Use the multithreaded pocketfft of scipy.fft for the batched cross-correlations if available
+try:
+    from scipy.fft import rfft, irfft, next_fast_len
+    FFT_KWARGS = {'workers': -1}
+except ImportError:
+    from seismic.xcorqc.fft import rfft, irfft
+    FFT_KWARGS = {}
+
+    def next_fast_len(target):
+        return 1 << int(np.ceil(np.log2(target)))
+    # end func
+# end try
+
 
 class XcorrPreprocessor:
     """
@@ -49,10 +67,14 @@ class XcorrPreprocessor:
         self.rcf = None
         # Timestamps corresponding to the time series data in ccf, lag, nsw
         self.start_times = None
+        # The start_times as numpy datetimes, for time axes of plots
+        self.np_times = None
         # Cross-correlation function sample
         self.ccf = None
         # Masked ccf according to quality criteria
         self.ccf_masked = None
+        # Flags of which rows of ccf are valid, i.e. not all zero
+        self.row_valid = None
         # Signal to noise ratio
         self.snr = None
         # Mask of when snr meets quality criteria
@@ -71,7 +93,10 @@ class XcorrPreprocessor:
         xc_start_times = xcdata.variables['IntervalStartTimes'][:]
         xc_end_times = xcdata.variables['IntervalEndTimes'][:]
         xc_lag = xcdata.variables['lag'][:]
-        xc_xcorr = xcdata.variables['xcorr'][:, :]
+        # Only read the lag window of interest of the cross-correlation functions, from the
+        # lags that round to -time_window up to those rounding to +time_window (exclusive)
+        lag_indices = np.searchsorted(xc_lag, [-self.time_window - 0.005, self.time_window - 0.005])
+        xc_xcorr = xcdata.variables['xcorr'][:, lag_indices[0]:lag_indices[1]]
         xc_num_stacked_windows = xcdata.variables['NumStackedWindows'][:]
         xcdata.close()
         xcdata = None
@@ -84,22 +109,25 @@ class XcorrPreprocessor:
 #        print("Date range for file {}:\n    {} -- {}".format(self.src_file, start_time, end_time))
 
         # Extract primary data
-        lag_indices = np.squeeze(np.argwhere(np.fabs(np.round(xc_lag, decimals=2)) == self.time_window))
         self.start_times = xc_start_times
+        self.np_times = _to_np_times(xc_start_times)
         self.lag = xc_lag[lag_indices[0]:lag_indices[1]]
-        self.ccf = xc_xcorr[:, lag_indices[0]:lag_indices[1]]
+        self.ccf = xc_xcorr.astype(np.float32, copy=False)
         self.nsw = xc_num_stacked_windows
 
         # Compute derived quantities used by multiple axes
-        zero_row_mask = (np.all(self.ccf == 0, axis=1))
-        valid_mask = np.ones_like(self.ccf)
-        valid_mask[zero_row_mask, :] = 0
-        valid_mask = (valid_mask > 0)
-        self.ccf_masked = np.ma.masked_array(self.ccf, mask=~valid_mask)
-        self.snr = np.nanmax(self.ccf_masked, axis=1) / np.nanstd(self.ccf_masked, axis=1)
+        self.row_valid = np.any(self.ccf != 0, axis=1)
+        self.ccf_masked = np.ma.masked_array(
+            self.ccf, mask=np.repeat(~self.row_valid[:, np.newaxis], self.ccf.shape[1], axis=1))
+        # Materialize the mask once as NaNs for the plain ndarray nan reductions
+        ccf_filled = self.ccf_masked.filled(np.nan)
+        valid_ccf = ccf_filled[self.row_valid]
+        snr = np.full(len(ccf_filled), np.nan, dtype=ccf_filled.dtype)
+        snr[self.row_valid] = nanmax(valid_ccf, axis=1) / nanstd(valid_ccf, axis=1)
+        self.snr = np.ma.masked_array(snr, mask=np.isnan(snr))
         if np.any(self.snr > self.snr_threshold):
-            self.snr_mask = (self.snr > self.snr_threshold)
-            self.rcf = np.nanmean(self.ccf_masked[self.snr_mask, :], axis=0)
+            self.snr_mask = (self.snr > self.snr_threshold).filled(False)
+            self.rcf = nanmean(ccf_filled[self.snr_mask, :], axis=0)
 
 
 # Get station codes from file name
@@ -126,8 +154,9 @@ def station_distance(federated_ds, code1, code2):
     """
     Determine the distance in km between a pair of stations at a given time.
 
-    :param federated_ds: Federated dataset to query for station coordinates
-    :type federated_ds: seismic.ASDFdatabase.FederatedASDFDataSet
+    :param federated_ds: Federated dataset to query for station coordinates, or its
+        ``unique_coordinates`` dictionary of [lon, lat] indexed by ``NETWORK.STATION``
+    :type federated_ds: seismic.ASDFdatabase.FederatedASDFDataSet or dict
     :param code1: Station and network code in the format ``NETWORK.STATION`` for first station
     :type code1: str
     :param code2: Station and network code in the format ``NETWORK.STATION`` for second station
@@ -135,11 +164,90 @@ def station_distance(federated_ds, code1, code2):
     :return: Distance between stations in kilometers
     :rtype: float
     """
-    coords1 = federated_ds.unique_coordinates[code1]
-    coords2 = federated_ds.unique_coordinates[code2]
+    coordinates = getattr(federated_ds, 'unique_coordinates', federated_ds)
+    coords1 = coordinates[code1]
+    coords2 = coordinates[code2]
     return distance(coords1, coords2)
 
 
+def split_valid_rows(ccf):
+    """
+    Split a time series of cross-correlation functions into a plain array and a flag per
+    row of whether the row is valid, so that subsequent processing needs no numpy.ma
+    dispatch. A row is valid if none of its samples are masked or NaN.
+
+    :param ccf: Time series of cross-correlation functions, optionally masked
+    :type ccf: numpy.ma.masked_array or numpy.array [2D]
+    :return: The cross-correlation functions with invalid samples zeroed; validity of each row
+    :rtype: (numpy.array [2D], numpy.array [1D] of bool)
+    """
+    invalid = np.ma.getmaskarray(ccf) | np.isnan(np.ma.getdata(ccf))
+    rows = np.where(invalid, 0, np.ma.getdata(ccf))
+    return rows, ~np.any(invalid, axis=1)
+
+
+def rows_spectra(rows):
+    """
+    Compute the zero padded conjugate spectrum of every row of a 2D array, for reuse when
+    cross-correlating the same rows with more than one reference function.
+
+    :param rows: Functions to be correlated against a reference, one per row
+    :type rows: numpy.array [2D]
+    :return: Conjugate spectra of the rows, one per row
+    :rtype: numpy.array [2D] of complex
+    """
+    # Zero pad to avoid circular wrap around of lags
+    n = next_fast_len(2 * rows.shape[1] - 1)
+    return np.conj(rfft(rows, n, axis=1, **FFT_KWARGS))
+
+
+def correlate_rows_same(ref, rows, spectra=None):
+    """
+    Cross-correlate a reference function with every row of a 2D array, all in one batch of FFTs.
+    Row i of the result is equivalent to ``scipy.signal.correlate(ref, rows[i], mode='same')``.
+
+    :param ref: Reference function
+    :type ref: numpy.array [1D]
+    :param rows: Functions to correlate against the reference, one per row, of the same length as ref
+    :type rows: numpy.array [2D]
+    :param spectra: Optional spectra of rows precomputed by :func:`rows_spectra`
+    :type spectra: numpy.array [2D] of complex
+    :return: Cross-correlation of ref with each row, centred on zero lag
+    :rtype: numpy.array [2D]
+    """
+    m = len(ref)
+    n = next_fast_len(2 * m - 1)
+    if spectra is None:
+        spectra = rows_spectra(rows)
+    c = irfft(rfft(ref, n)[np.newaxis, :] * spectra, n, axis=1, **FFT_KWARGS)
+    # Lag k is at index k mod n, so roll negative lags to the front and keep the central m lags
+    return np.roll(c, m // 2, axis=1)[:, :m]
+
+
+def pearson_rows(ref, rows):
+    """
+    Compute the Pearson correlation coefficient of a reference function with every row of
+    a 2D array at once. Element i of the result is equivalent to
+    ``scipy.stats.pearsonr(ref, rows[i])[0]``.
+
+    :param ref: Reference function
+    :type ref: numpy.array [1D]
+    :param rows: Functions to correlate against the reference, one per row, of the same length as ref
+    :type rows: numpy.array [2D]
+    :return: Pearson correlation coefficient of each row with ref
+    :rtype: numpy.array [1D]
+    """
+    # Single pass over the rows accumulating raw sums, in double precision to limit the
+    # cancellation in the centred sums
+    m = len(ref)
+    sx = np.sum(rows, axis=1, dtype=np.float64)
+    sxx = np.einsum('ij,ij->i', rows, rows, dtype=np.float64)
+    sxy = np.einsum('ij,j->i', rows, ref, dtype=np.float64)
+    sy = np.sum(ref, dtype=np.float64)
+    syy = np.einsum('j,j->', ref, ref, dtype=np.float64)
+    return (sxy - sx * sy / m) / np.sqrt((sxx - sx * sx / m) * (syy - sy * sy / m))
+
+
 def compute_estimated_clock_corrections(rcf, snr_mask, ccf_masked, x_lag, pcf_cutoff_threshold):
     """
     Compute the estimated GPS clock corrections given series of cross-correlation functions
@@ -151,8 +259,9 @@ def compute_estimated_clock_corrections(rcf, snr_mask, ccf_masked, x_lag, pcf_cu
     :param snr_mask: Mask of which samples meet minimum SNR criteria
     :type snr_mask: numpy array mask
     :param ccf_masked: Time series of cross-correlation functions, masked by
-                       externally decided validity flags.
-    :type ccf_masked: numpy.ma.masked_array
+                       externally decided validity flags. Rows with any masked or NaN
+                       samples are excluded.
+    :type ccf_masked: numpy.ma.masked_array or numpy.array
     :param x_lag: The x-axis, the lag
     :type x_lag: numpy.array
     :param pcf_cutoff_threshold: Minimum threshold for Pearson correlation factor.
@@ -164,67 +273,105 @@ def compute_estimated_clock_corrections(rcf, snr_mask, ccf_masked, x_lag, pcf_cu
     # Make an initial estimate of the shift, and only mask out a row if the Pearson coefficient
     # is less than the threshold AFTER applying the shift. Otherwise we will be masking out
     # some of the most interesting regions where shifts occur.
-    correction = []
-    ccf_shifted = []
-    for row in ccf_masked:
-        if np.ma.is_masked(row) or rcf is None:
-            correction.append(np.nan)
-            ccf_shifted.append(np.array([np.nan] * ccf_masked.shape[1]))
-            continue
-
-        # The logic here needs to be expanded to allow for possible mirroring of the CCF
-        # as well as a shift.
-        c3 = scipy.signal.correlate(rcf, row, mode='same')
-        c3 /= np.max(c3)
-        peak_index = np.argmax(c3)
-        shift_size = int(peak_index - len(c3) / 2)
-        row_shifted = np.roll(row, shift_size)
-        # Zero the rolled in values
-        if shift_size > 0:
-            row_shifted[0:shift_size] = 0
-        elif shift_size < 0:
-            row_shifted[shift_size:] = 0
-        ccf_shifted.append(row_shifted)
-        # Store first order corrections.
-        peak_lag = x_lag[peak_index]
-        correction.append(peak_lag)
-    # end for
-    correction = np.array(correction)
-    ccf_shifted = np.array(ccf_shifted)
+    n_rows, n_lags = ccf_masked.shape
+    rows, row_valid = split_valid_rows(ccf_masked)
+    correction = np.full(n_rows, np.nan)
+    # Keep the precision of the input, single precision for correlator outputs
+    row_rcf_crosscorr = np.full((n_rows, n_lags), np.nan, dtype=rows.dtype)
+    if rcf is None or not np.any(row_valid):
+        return np.full(n_lags, np.nan, dtype=rows.dtype), correction, row_rcf_crosscorr
+    rcf = np.asarray(rcf, dtype=rows.dtype)
+
+    # The logic here needs to be expanded to allow for possible mirroring of the CCF
+    # as well as a shift.
+    # The spectra of the valid rows are shared by the first and second order passes
+    valid_rows = rows[row_valid]
+    valid_spectra = rows_spectra(valid_rows)
+    c3 = correlate_rows_same(rcf, valid_rows, valid_spectra)
+    # Only the peak position is needed here, so the correlations are not normalised
+    peak_index = np.argmax(c3, axis=1)
+    shift_size = np.trunc(peak_index - n_lags / 2).astype(int)
+    # Shift all rows in one gather, zeroing the rolled in values
+    src_col = np.arange(n_lags)[np.newaxis, :] - shift_size[:, np.newaxis]
+    in_range = (src_col >= 0) & (src_col < n_lags)
+    row_shifted = np.take_along_axis(valid_rows, np.clip(src_col, 0, n_lags - 1), axis=1)
+    ccf_shifted = np.full((n_rows, n_lags), np.nan, dtype=rows.dtype)
+    ccf_shifted[row_valid] = np.where(in_range, row_shifted, 0)
+    # Store first order corrections.
+    correction[row_valid] = x_lag[peak_index]
     # Recompute the RCF with first order clock corrections.
-    rcf_corrected = np.nanmean(ccf_shifted[snr_mask, :], axis=0)
+    # Invalid rows are all NaN and valid rows all finite, so a plain mean over valid rows suffices
+    rcf_corrected = np.mean(ccf_shifted[np.ma.filled(snr_mask, False) & row_valid, :], axis=0)
 
     # For the Pearson coeff threshold, apply it against the CORRECTED RCF after the application
     # of estimated clock corrections.
-    row_rcf_crosscorr = []
-    for i, row in enumerate(ccf_masked):
-        if np.ma.is_masked(row) or rcf is None:
-            row_rcf_crosscorr.append([np.nan] * ccf_masked.shape[1])
-            continue
-
-        pcf_corrected, _ = scipy.stats.pearsonr(rcf_corrected, ccf_shifted[i, :])
-        if pcf_corrected < pcf_cutoff_threshold:
-            correction[i] = np.nan
-            row_rcf_crosscorr.append([np.nan] * ccf_masked.shape[1])
-            continue
-        # Compute second order corrections based on first order corrected RCF
-        c3 = scipy.signal.correlate(rcf_corrected, row, mode='same')
-        c3 /= np.max(c3)
-        peak_index = np.argmax(c3)
-        peak_lag = x_lag[peak_index]
-        correction[i] = peak_lag
-        row_rcf_crosscorr.append(c3)
-    # end for
-    row_rcf_crosscorr = np.array(row_rcf_crosscorr)
+    pcf_corrected = pearson_rows(rcf_corrected, ccf_shifted[row_valid])
+    valid_accepted = ~(pcf_corrected < pcf_cutoff_threshold)
+    row_accepted = row_valid.copy()
+    row_accepted[row_valid] = valid_accepted
+    correction[row_valid & ~row_accepted] = np.nan
+    # Compute second order corrections based on first order corrected RCF
+    c3 = correlate_rows_same(rcf_corrected, valid_rows[valid_accepted], valid_spectra[valid_accepted])
+    peak_index = np.argmax(c3, axis=1)
+    c3 /= np.take_along_axis(c3, peak_index[:, np.newaxis], axis=1)
+    correction[row_accepted] = x_lag[peak_index]
+    row_rcf_crosscorr[row_accepted] = c3
 
     return rcf_corrected, correction, row_rcf_crosscorr
 
 
+def _to_np_times(y_times):
+    """
+    Convert UNIX timestamps to numpy datetimes at second resolution, as
+    ``datetime.datetime.utcfromtimestamp`` would per element. Times that are already
+    numpy datetimes are returned as is.
+
+    :param y_times: UNIX timestamps in seconds
+    :type y_times: numpy.array [1D]
+    :return: Corresponding UTC times
+    :rtype: numpy.array of numpy.datetime64 [1D]
+    """
+    if np.issubdtype(np.asarray(y_times).dtype, np.datetime64):
+        return y_times
+    us_times = np.round(np.asarray(y_times, dtype=np.float64) * 1e6).astype(np.int64)
+    return us_times.astype('datetime64[us]').astype('datetime64[s]')
+
+
+def plot_lag_time_raster(ax, x_lag, np_times, data, **kwargs):
+    """
+    Plot a raster of data with lag along the columns and time along the rows, one
+    cell centred on each (lag, time) sample. When both axes are uniformly sampled the
+    raster is drawn as an image, which is much faster to render than pcolormesh.
+
+    :param ax: Axes to plot on
+    :type ax: matplotlib.axes.Axes
+    :param x_lag: The x-axis, the lag
+    :type x_lag: numpy.array [1D]
+    :param np_times: The y-axis, the time of each row
+    :type np_times: numpy.array of numpy.datetime64 [1D]
+    :param data: Values to plot, one row per time and one column per lag
+    :type data: numpy.array [2D]
+    :param kwargs: Additional colour mapping arguments passed on to matplotlib
+    :return: The plotted raster
+    :rtype: matplotlib.image.AxesImage or matplotlib.collections.QuadMesh
+    """
+    dx = np.diff(x_lag)
+    dt = np.diff(np_times).astype(float)
+    if len(dx) and len(dt) and np.allclose(dx, dx[0]) and np.all(dt == dt[0]):
+        # Set up the date axis as pcolormesh would, then place the image by its date numbers
+        ax.yaxis.update_units(np_times)
+        y0, y1 = matplotlib.dates.date2num(np_times[[0, -1]])
+        half_dy = 0.5 * (y1 - y0) / (len(np_times) - 1)
+        extent = [x_lag[0] - 0.5 * dx[0], x_lag[-1] + 0.5 * dx[0], y0 - half_dy, y1 + half_dy]
+        return ax.imshow(data, aspect='auto', origin='lower', extent=extent,
+                         interpolation='nearest', **kwargs)
+    return ax.pcolormesh(x_lag, np_times, data, rasterized=True, **kwargs)
+
+
 def plot_xcorr_time_series(ax, x_lag, y_times, xcorr_data, use_formatter=False):
 
-    np_times = np.array([datetime.datetime.utcfromtimestamp(v) for v in y_times]).astype('datetime64[s]')
-    gx, gy = np.meshgrid(x_lag, np_times)
-    im = ax.pcolormesh(gx, gy, xcorr_data, cmap='RdYlBu_r', vmin=0, vmax=1, rasterized=True)
+    np_times = _to_np_times(y_times)
+    im = plot_lag_time_raster(ax, x_lag, np_times, xcorr_data, cmap='RdYlBu_r', vmin=0, vmax=1)
 
     if use_formatter:
         date_formatter = matplotlib.dates.DateFormatter("%Y-%m-%d")
@@ -232,9 +379,9 @@ def plot_xcorr_time_series(ax, x_lag, y_times, xcorr_data, use_formatter=False):
         ax.yaxis.set_major_formatter(date_formatter)
         ax.yaxis.set_major_locator(date_locator)
     else:
-        labels = np.datetime_as_string(np_times, unit='D')
-        ax.set_yticks(np_times[::7])
-        ax.set_yticklabels(labels[::7])
+        tick_times = np_times[::7]
+        ax.set_yticks(tick_times)
+        ax.set_yticklabels(np.datetime_as_string(tick_times, unit='D'))
 
     ax.set_xlabel('Lag [s]')
     ax.set_ylabel('Days')
@@ -247,8 +394,8 @@ def plot_xcorr_time_series(ax, x_lag, y_times, xcorr_data, use_formatter=False):
 
 def plot_reference_correlation_function(ax, x_lag, rcf, rcf_corrected, snr_threshold):
     if rcf is not None:
-        ax.axvline(x_lag[np.argmax(rcf)], c='#c66da9', lw=2,
-                   label='{:5.2f} s'.format(x_lag[np.argmax(rcf)]))
+        rcf_peak_lag = x_lag[np.argmax(rcf)]
+        ax.axvline(rcf_peak_lag, c='#c66da9', lw=2, label='{:5.2f} s'.format(rcf_peak_lag))
         ax.plot(x_lag, rcf, c='#42b3f4',
                 label="Reference CCF (RCF)\n"
                       "Based on Subset\n"
@@ -264,7 +411,7 @@ def plot_reference_correlation_function(ax, x_lag, rcf, rcf_corrected, snr_thres
 
 def plot_stacked_window_count(ax, x_nsw, y_times):
     ax.plot(x_nsw, y_times, c='#529664')
-    ax.set_ylim((min(y_times), max(y_times)))
+    ax.set_ylim((np.min(y_times), np.max(y_times)))
     ax.set_yticklabels([])
     ax.set_xlabel('\n'.join(wrap('# of Hourly Stacked Windows', 12)))
     xtl = ax.get_xticklabels()
@@ -282,20 +429,15 @@ def plot_snr_histogram(ax, snr, time_window, nbins=10):
 
 
 def plot_pearson_corr_coeff(ax, rcf, ccf_masked, y_times):
-    cc = []
-    for row in ccf_masked:
-        if np.ma.is_masked(row) or rcf is None:
-            cc.append(np.nan)
-        else:
-            pcf, _ = scipy.stats.pearsonr(rcf, row)
-            cc.append(pcf)
-    # end for
-    pcf = np.array(cc)
+    pcf = np.full(ccf_masked.shape[0], np.nan)
+    if rcf is not None:
+        rows, row_valid = split_valid_rows(ccf_masked)
+        pcf[row_valid] = pearson_rows(rcf, rows[row_valid])
     # Compute CC mean
     ccav = np.mean(np.ma.masked_array(pcf, mask=np.isnan(pcf)))
 
     ax.plot(pcf, y_times, c='#d37f26')
-    ax.set_ylim((min(y_times), max(y_times)))
+    ax.set_ylim((np.min(y_times), np.max(y_times)))
     ax.set_yticklabels([])
     ax.set_xticks([0, 1])
     ax.set_xlabel('\n'.join(wrap('Raw Pearson\nCoeff. (vs RCF)', 15)))
@@ -306,27 +448,26 @@ def plot_pearson_corr_coeff(ax, rcf, ccf_masked, y_times):
 
 def plot_estimated_timeshift(ax, x_lag, y_times, correction, annotation=None, row_rcf_crosscorr=None):
 
+    np_times = _to_np_times(y_times)
+    time_range = (np.min(np_times), np.max(np_times))
     if row_rcf_crosscorr is not None:
         # Line plot laid over the top of RCF * CCF
-        np_times = np.array([datetime.datetime.utcfromtimestamp(v) for v in y_times]).astype('datetime64[s]')
-        gx, gy = np.meshgrid(x_lag, np_times)
         plot_data = row_rcf_crosscorr
         crange_floor = 0.7
         plot_data[np.isnan(plot_data)] = crange_floor
         plot_data[(plot_data < crange_floor)] = crange_floor
         nan_mask = np.isnan(correction)
         plot_data[nan_mask, :] = np.nan
-        ax.pcolormesh(gx, gy, plot_data, cmap='RdYlBu_r', rasterized=True)
-        ax.set_ylim((min(np_times), max(np_times)))
+        plot_lag_time_raster(ax, x_lag, np_times, plot_data, cmap='RdYlBu_r')
+        ax.set_ylim(time_range)
         xrange = 1.2 * np.nanmax(np.abs(correction))
         ax.set_xlim((-xrange, xrange))
         col = '#ffffff'
         ax.plot(correction, np_times, 'o--', color=col, fillstyle='none', markersize=4, alpha=0.8)
     else:
         # Plain line plot
-        np_times = np.array([datetime.datetime.utcfromtimestamp(v) for v in y_times]).astype('datetime64[s]')
         ax.plot(correction, np_times, 'o-', c='#f22e62', lw=1.5, fillstyle='none', markersize=4)
-        ax.set_ylim((min(np_times), max(np_times)))
+        ax.set_ylim(time_range)
         xlim = list(ax.get_xlim())
         xlim[0] = min(xlim[0], -1)
         xlim[1] = max(xlim[1], 1)
@@ -378,7 +519,7 @@ def plot_xcorr_file_clock_analysis(src_file, asdf_dataset, time_window, snr_thre
     ax6 = fig.add_axes([0.8, 0.075, 0.195, 0.725])  # estimate timeshifts
 
     # Plot CCF image =======================
-    plot_xcorr_time_series(ax1, xcorr_pp.lag, xcorr_pp.start_times, xcorr_pp.ccf)
+    plot_xcorr_time_series(ax1, xcorr_pp.lag, xcorr_pp.np_times, xcorr_pp.ccf)
 
     # Plot CCF-template (reference CCF) ===========
     plot_reference_correlation_function(ax2, xcorr_pp.lag, xcorr_pp.rcf, rcf_corrected, snr_threshold)
@@ -409,20 +550,20 @@ def plot_xcorr_file_clock_analysis(src_file, asdf_dataset, time_window, snr_thre
     # plot Timeshift =====================
     annotation = 'Min. corrected Pearson Coeff={:3.3f}'.format(PCF_CUTOFF_THRESHOLD)
     if underlay_rcf_xcorr:
-        plot_estimated_timeshift(ax6, xcorr_pp.lag, xcorr_pp.start_times, correction, annotation=annotation,
+        plot_estimated_timeshift(ax6, xcorr_pp.lag, xcorr_pp.np_times, correction, annotation=annotation,
                                  row_rcf_crosscorr=row_rcf_crosscorr)
     else:
-        plot_estimated_timeshift(ax6, xcorr_pp.lag, xcorr_pp.start_times, correction, annotation=annotation)
+        plot_estimated_timeshift(ax6, xcorr_pp.lag, xcorr_pp.np_times, correction, annotation=annotation)
 
     # Print and display
     if pdf_file is not None:
         from matplotlib.backends.backend_pdf import PdfPages
         pdf_out = PdfPages(pdf_file)
-        pdf_out.savefig(plt.gcf(), dpi=600)
+        pdf_out.savefig(fig, dpi=300)
         pdf_out.close()
 
     if png_file is not None:
-        plt.savefig(png_file, dpi=150)
+        fig.savefig(png_file, dpi=150)
 
     if show:
         plt.show()
@@ -436,7 +577,7 @@ def plot_xcorr_file_clock_analysis(src_file, asdf_dataset, time_window, snr_thre
     ax5.clear()
     ax6.clear()
     fig.clf()
-    plt.close('all')
+    plt.close(fig)
 
 
 def read_correlator_config(nc_file):
@@ -471,10 +612,43 @@ def read_correlator_config(nc_file):
     return settings_df, title_tag
 
 
-def batch_process_xcorr(src_files, dataset, time_window, snr_threshold, save_plots=True, underlay_rcf_xcorr=False):
+# Station coordinates shared with each plotting worker process, see _init_plot_worker
+_worker_coordinates = None
+
+
+def _init_plot_worker(coordinates):
+    """
+    Set up a plotting worker process with the non-interactive Agg backend, as plots are only
+    written to file, and the station coordinates of the dataset.
+    """
+    global _worker_coordinates
+    plt.switch_backend('Agg')
+    _worker_coordinates = coordinates
+
+
+def _plot_xcorr_file_task(args):
+    """
+    Plot the clock analysis of one .nc file to a png file in a worker process.
+
+    :return: The source file, and the error message if plotting failed or None
+    :rtype: tuple(str, str)
+    """
+    src_file, png_file, time_window, snr_threshold, underlay_rcf_xcorr, title_tag, settings = args
+    try:
+        plot_xcorr_file_clock_analysis(src_file, _worker_coordinates, time_window, snr_threshold,
+                                       png_file=png_file, show=False, underlay_rcf_xcorr=underlay_rcf_xcorr,
+                                       title_tag=title_tag, settings=settings)
+    except Exception as e:
+        return src_file, str(e)
+    return src_file, None
+
+
+def batch_process_xcorr(src_files, dataset, time_window, snr_threshold, save_plots=True, underlay_rcf_xcorr=False,
+                        processes=1):
     """
     Process a batch of .nc files to generate standard visualization graphics. PNG files are output alongside the
-    source .nc file. To suppress file output, set save_plots=False.
+    source .nc file. To suppress file output, set save_plots=False. Saved plots can be generated in parallel over a
+    pool of worker processes, see processes.
 
     :param src_files: List of files to process
     :type src_files: Iterable of str
@@ -489,21 +663,27 @@ def batch_process_xcorr(src_files, dataset, time_window, snr_threshold, save_plo
     :param underlay_rcf_xcorr: Show the individual correlation of row sample with RCF beneath the computed time lag,
         defaults to False
     :param underlay_rcf_xcorr: bool, optional
+    :param processes: Number of worker processes to save plots with, defaults to 1, which plots in this
+        process. None uses the number of CPUs.
+    :type processes: int, optional
     :return: List of files for which processing failed, and associated error.
     :rtype: list(tuple(str, str))
     """
     PY2 = (sys.version_info[0] == 2)
+    parallel = save_plots and processes != 1
 
     pbar = tqdm(total=len(src_files), dynamic_ncols=True)
     found_preexisting = False
     failed_files = []
     skipped_count = 0
     success_count = 0
+    plot_tasks = []
     for src_file in src_files:
         _, base_file = os.path.split(src_file)
         pbar.set_description(base_file)
-        # Sleep to ensure progress bar is refreshed
-        time.sleep(0.2)
+        if not parallel:
+            # Sleep to ensure progress bar is refreshed
+            time.sleep(0.2)
 
         if not os.path.exists(src_file):
             tqdm.write("ERROR! File {} not found!".format(src_file))
@@ -529,6 +709,10 @@ def batch_process_xcorr(src_files, dataset, time_window, snr_threshold, save_plo
                         skipped_count += 1
                         pbar.update()
                         continue
+                if parallel:
+                    plot_tasks.append((src_file, png_file, time_window, snr_threshold, underlay_rcf_xcorr,
+                                       title_tag, settings))
+                    continue
                 plot_xcorr_file_clock_analysis(src_file, dataset, time_window, snr_threshold, png_file=png_file,
                                                show=False, underlay_rcf_xcorr=underlay_rcf_xcorr,
                                                title_tag=title_tag, settings=settings)
@@ -547,6 +731,23 @@ def batch_process_xcorr(src_files, dataset, time_window, snr_threshold, save_plo
         if PY2:
             gc.collect()
 
+    if plot_tasks:
+        # Workers only need the station coordinates of the dataset, which unlike the dataset can be pickled
+        coordinates = dict(getattr(dataset, 'unique_coordinates', dataset))
+        pool = Pool(processes, initializer=_init_plot_worker, initargs=(coordinates,))
+        try:
+            for src_file, err_msg in pool.imap_unordered(_plot_xcorr_file_task, plot_tasks):
+                pbar.set_description(os.path.split(src_file)[1])
+                if err_msg is None:
+                    success_count += 1
+                    pbar.update()
+                else:
+                    tqdm.write("ERROR processing file {}".format(src_file))
+                    failed_files.append((src_file, err_msg))
+        finally:
+            pool.close()
+            pool.join()
+
     pbar.close()
 
     if found_preexisting:
@@ -556,7 +757,7 @@ def batch_process_xcorr(src_files, dataset, time_window, snr_threshold, save_plo
     return failed_files
 
 
-def batch_process_folder(folder_name, dataset, time_window, snr_threshold, save_plots=True):
+def batch_process_folder(folder_name, dataset, time_window, snr_threshold, save_plots=True, processes=1):
     """
     Process all the .nc files in a given folder into graphical visualizations.
 
@@ -570,12 +771,16 @@ def batch_process_folder(folder_name, dataset, time_window, snr_threshold, save_
     :type snr_threshold: float
     :param save_plots: Whether to save plots to file, defaults to True
     :param save_plots: bool, optional
+    :param processes: Number of worker processes to save plots with, defaults to 1, which plots in this
+        process. None uses the number of CPUs.
+    :type processes: int, optional
     """
     src_files = glob.glob(os.path.join(folder_name, '*.nc'))
     print("Found {} .nc files in {}".format(len(src_files), folder_name))
 
     failed_files = batch_process_xcorr(src_files, dataset, time_window=time_window,
-                                       snr_threshold=snr_threshold, save_plots=save_plots)
+                                       snr_threshold=snr_threshold, save_plots=save_plots,
+                                       processes=processes)
     if failed_files:
         print("The following files experienced errors:")
         for fname, err_msg in failed_files:
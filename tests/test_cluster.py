@@ -18,14 +18,20 @@ from subprocess import check_call
 import numpy as np
 import pandas as pd
 import pytest
-from obspy import read_events
+from obspy import read_events, UTCDateTime
 from obspy.core.event import Catalog
 from obspy.geodetics import locations2degrees
 from pytest import approx
 from legacy.cluster.cluster import (process_event,
                                      process_many_events,
+                                     read_sc3ml_events,
                                      Grid,
                                      column_names,
+                                     gather_column_names,
+                                     gather_column_dtypes,
+                                     ArrivalWriter,
+                                     _gather_all,
+                                     _read_gathered_csv,
                                      Region,
                                      recursive_glob,
                                      STATION_LATITUDE,
@@ -170,6 +176,35 @@ def test_single_event_arrivals(event_xml, arr_type):
     assert set(arrival_stations) == set(arr_sta)
 
 
+@pytest.mark.filterwarnings("ignore")
+def test_read_sc3ml_events(event_xml):
+    events = read_events(event_xml).events
+    lite_events = read_sc3ml_events(event_xml)
+    assert len(lite_events) == len(events)
+
+    for event, lite_event in zip(events, lite_events):
+        origin = event.preferred_origin() or event.origins[0]
+        lite_origin = lite_event.preferred_origin() or lite_event.origins[0]
+        assert lite_origin.resource_id == origin.resource_id
+        assert lite_origin.time == origin.time
+        assert lite_origin.latitude == origin.latitude
+        assert lite_origin.longitude == origin.longitude
+        assert lite_origin.depth == origin.depth
+        assert [(a.pick_id, a.phase, a.time_residual)
+                for a in lite_origin.arrivals] == \
+            [(a.pick_id, a.phase, a.time_residual) for a in origin.arrivals]
+
+        # picks in the same order as read_events
+        assert [p.resource_id for p in lite_event.picks] == \
+            [p.resource_id for p in event.picks]
+        for lite_pick, pick in zip(lite_event.picks, event.picks):
+            assert lite_pick.time == pick.time
+            assert lite_pick.waveform_id.station_code == \
+                pick.waveform_id.station_code
+            assert [c.text for c in lite_pick.comments] == \
+                [c.text for c in pick.comments]
+
+
 # a very large residual allowed, imply we are not really using the filter
 @pytest.fixture(params=[1e6, 1], name='residual_bool')
 def res_bool(request):
@@ -482,6 +517,88 @@ def _test_sort_and_filtered(outfile, wave_type, residual_bool):
     assert all(np.diff(p_df['source_block'].values) >= 0)
 
 
+def _write_gathered(outfile, cluster_info, file_format):
+    """write the gather output of one process_event call, as gather does"""
+    writer = ArrivalWriter(rank=0, wave_type='P S', output_file=outfile,
+                           file_format=file_format)
+    writer.write(cluster_info)
+    writer.close()
+    for t in ['P', 'S']:
+        _gather_all(outfile, t, file_format)
+
+
+@pytest.mark.filterwarnings("ignore")
+def test_sort_gathered_csv(xml, random_filename):
+    outfile = random_filename()
+    cluster_info = process_event(
+        read_events(xml)[0], stations=read_stations(stations_file),
+        grid=Grid(nx=1440, ny=720, dz=25.0), wave_type='P S', counter=1)
+    _write_gathered(outfile, cluster_info, 'csv')
+
+    gathered = pd.read_csv(outfile + '_P.csv', header=None,
+                           names=gather_column_names)
+    # reject about half the arrivals
+    residual_cutoff = np.median(abs(gathered['residual']))
+    kept = gathered[abs(gathered['residual']) < residual_cutoff].copy()
+    kept['observed_tt'] = [
+        UTCDateTime(p) - UTCDateTime(o) + e for p, o, e in
+        zip(kept['pick_time'], kept['origin_time'], kept['ellipticity_corr'])]
+    med = kept.groupby(by=['source_block', 'station_block'])[
+        'observed_tt'].quantile(q=.5, interpolation='lower')
+
+    sorted_file = outfile + '_sorted_P.csv'
+    check_call(['cluster', 'sort', outfile + '_P.csv', str(residual_cutoff),
+                '-s', sorted_file])
+    sorted_df = pd.read_csv(sorted_file, header=None, names=column_names,
+                            sep=' ')
+
+    assert all(abs(sorted_df['residual'].values) < residual_cutoff)
+    assert sorted_df.shape[0] == med.shape[0]
+    np.testing.assert_array_equal(sorted_df['source_block'].values,
+                                  med.index.get_level_values(0))
+    np.testing.assert_array_equal(sorted_df['station_block'].values,
+                                  med.index.get_level_values(1))
+    assert sorted_df['observed_tt'].values == approx(med.values, abs=1e-5)
+
+
+@pytest.mark.filterwarnings("ignore")
+def test_sort_gathered_csv_parquet(xml, random_filename):
+    pytest.importorskip('pyarrow')
+    cluster_info = process_event(
+        read_events(xml)[0], stations=read_stations(stations_file),
+        grid=Grid(nx=1440, ny=720, dz=25.0), wave_type='P S', counter=1)
+
+    sorted_dfs = []
+    for file_format in ['csv', 'parquet']:
+        outfile = random_filename()
+        _write_gathered(outfile, cluster_info, file_format)
+        sorted_file = outfile + '_sorted_P.csv'
+        check_call(['cluster', 'sort', outfile + '_P.' + file_format, '5.0',
+                    '-s', sorted_file])
+        sorted_dfs.append(pd.read_csv(sorted_file, header=None,
+                                      names=column_names, sep=' '))
+
+    assert sorted_dfs[0].shape[0] > 0
+    pd.testing.assert_frame_equal(*sorted_dfs)
+
+
+def test_read_gathered_csv_chunks(cluster_outfiles):
+    p_file = cluster_outfiles[0] + '_P.csv'
+    residual_cutoff = 5.0
+
+    # filter of the whole file at once
+    gathered = pd.read_csv(p_file, header=None, names=gather_column_names,
+                           dtype=gather_column_dtypes)
+    expected = gathered[abs(gathered['residual']) < residual_cutoff]
+
+    chunked = _read_gathered_csv(p_file, residual_cutoff, chunksize=100)
+
+    assert gathered.shape[0] > 100  # more than one chunk
+    np.testing.assert_array_equal(chunked.index.values, expected.index.values)
+    common = [c for c in column_names if c != 'observed_tt']
+    pd.testing.assert_frame_equal(chunked[common], expected[common])
+
+
 def recursive_read_events(xmls):
     cat = Catalog()
     for x in xmls:
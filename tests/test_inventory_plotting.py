@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pandas as pd
+from obspy.core.inventory import Inventory
+
+from seismic.inventory.pdconvert import pd2Network
+from seismic.inventory.plotting import _writeStationTxt, no_instruments
+from seismic.inventory.table_format import TABLE_COLUMNS
+
+
+def _network_df():
+    # Stations out of code order, several channels per station, and a channel with zero
+    # elevation for which obspy falls back to the station elevation.
+    stations = [('MEEK', -26.638, 118.615, 528.0),
+                ('ARMA', -30.4198, 151.628, 0.0),
+                ('CMSA', -31.4294, 150.2943, 314.5)]
+    d = []
+    for code, lat, lon, ele in stations:
+        for i, channel in enumerate(['BHZ', 'BHN', 'BHE']):
+            if code == 'CMSA' and channel == 'BHN':
+                ele_ch = 0.0
+            else:
+                ele_ch = ele
+            d.append(('AU', code, lat, lon, ele_ch,
+                      np.datetime64('2001-02-03T04:05:06'), np.datetime64('2030-01-01T00:00:00'),
+                      channel, np.datetime64('2001-02-03T04:05:06') + np.timedelta64(i, 'D'),
+                      np.datetime64('2025-12-31T23:59:59')))
+    return pd.DataFrame(d, columns=list(TABLE_COLUMNS))
+
+
+def test_write_stationtxt_matches_obspy(tmpdir):
+    data = _network_df()
+    direct_fname = os.path.join(str(tmpdir), 'direct.txt')
+    obspy_fname = os.path.join(str(tmpdir), 'obspy.txt')
+
+    _writeStationTxt(data, direct_fname)
+    inv = Inventory(networks=[pd2Network('AU', data, no_instruments)], source='EHB')
+    inv.write(obspy_fname, format="stationtxt")
+
+    with open(direct_fname) as f:
+        direct = f.read()
+    with open(obspy_fname) as f:
+        expected = f.read()
+    assert len(direct.splitlines()) == len(data) + 1
+    assert direct == expected
@@ -0,0 +1,130 @@
+import os
+import sys
+import warnings
+
+import numpy as np
+import pytest
+import scipy.signal
+import scipy.stats
+
+from seismic import xcorqc
+
+# xcorr_station_clock_analysis imports its sibling analytic_plot_utils as a top level module
+sys.path.append(os.path.dirname(xcorqc.__file__))
+from seismic.xcorqc.xcorr_station_clock_analysis import compute_estimated_clock_corrections
+
+
+def _reference_clock_corrections(rcf, snr_mask, ccf_masked, x_lag, pcf_cutoff_threshold):
+    """
+    Clock corrections computed one row at a time with scipy, as they were before the
+    rows were cross-correlated in batches.
+    """
+    n_lags = ccf_masked.shape[1]
+    correction = []
+    ccf_shifted = []
+    for row in ccf_masked:
+        if np.ma.is_masked(row) or rcf is None:
+            correction.append(np.nan)
+            ccf_shifted.append(np.array([np.nan] * n_lags))
+            continue
+        row = np.ma.getdata(row).astype(np.float64)
+        c3 = scipy.signal.correlate(rcf, row, mode='same')
+        c3 /= np.max(c3)
+        peak_index = np.argmax(c3)
+        shift_size = int(peak_index - len(c3) / 2)
+        row_shifted = np.roll(row, shift_size)
+        # Zero the rolled in values
+        if shift_size > 0:
+            row_shifted[0:shift_size] = 0
+        elif shift_size < 0:
+            row_shifted[shift_size:] = 0
+        ccf_shifted.append(row_shifted)
+        correction.append(x_lag[peak_index])
+    correction = np.array(correction)
+    ccf_shifted = np.array(ccf_shifted)
+    with warnings.catch_warnings():
+        # Mean of no rows when none are valid
+        warnings.simplefilter('ignore', RuntimeWarning)
+        rcf_corrected = np.nanmean(ccf_shifted[snr_mask, :], axis=0)
+
+    row_rcf_crosscorr = []
+    for i, row in enumerate(ccf_masked):
+        if np.ma.is_masked(row) or rcf is None:
+            row_rcf_crosscorr.append([np.nan] * n_lags)
+            continue
+        row = np.ma.getdata(row).astype(np.float64)
+        pcf_corrected, _ = scipy.stats.pearsonr(rcf_corrected, ccf_shifted[i, :])
+        if pcf_corrected < pcf_cutoff_threshold:
+            correction[i] = np.nan
+            row_rcf_crosscorr.append([np.nan] * n_lags)
+            continue
+        c3 = scipy.signal.correlate(rcf_corrected, row, mode='same')
+        c3 /= np.max(c3)
+        peak_index = np.argmax(c3)
+        correction[i] = x_lag[peak_index]
+        row_rcf_crosscorr.append(c3)
+    row_rcf_crosscorr = np.array(row_rcf_crosscorr)
+
+    return rcf_corrected, correction, row_rcf_crosscorr
+
+
+def _mock_ccf(n_rows, n_lags, seed=0):
+    """
+    Single precision cross-correlation time series of a pulse at a drifting lag, with some
+    rows of pure noise and some all zero rows masked out as XcorrPreprocessor does.
+    """
+    rng = np.random.RandomState(seed)
+    x_lag = np.linspace(-50.0, 50.0, n_lags)
+    peak_lag = 2.0 + 10.0 * np.sin(np.linspace(0, np.pi, n_rows))
+    ccf = np.exp(-((x_lag[np.newaxis, :] - peak_lag[:, np.newaxis]) / 3.0) ** 2)
+    ccf += 0.1 * rng.standard_normal((n_rows, n_lags))
+    ccf[[3, 11]] = rng.standard_normal((2, n_lags))
+    ccf[[5, 17]] = 0
+    ccf = ccf.astype(np.float32)
+    zero_rows = np.all(ccf == 0, axis=1)
+    ccf_masked = np.ma.masked_array(ccf, mask=np.repeat(zero_rows[:, np.newaxis], n_lags, axis=1))
+    snr = np.ma.max(ccf_masked, axis=1) / np.ma.std(ccf_masked, axis=1)
+    snr_mask = np.ma.filled(snr > 3.0, False)
+    rcf = np.mean(ccf_masked[snr_mask, :], axis=0).data
+    return rcf, snr_mask, ccf_masked, x_lag
+
+
+def _assert_corrections_equal(result, expected):
+    rcf_corrected, correction, row_rcf_crosscorr = result
+    expected_rcf, expected_correction, expected_crosscorr = expected
+    np.testing.assert_allclose(rcf_corrected, expected_rcf, rtol=1e-5, atol=1e-6)
+    np.testing.assert_array_equal(correction, expected_correction)
+    np.testing.assert_allclose(row_rcf_crosscorr, expected_crosscorr, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('n_lags', [400, 401])
+@pytest.mark.parametrize('pcf_cutoff_threshold', [0.5, 1.5])
+def test_estimated_clock_corrections(n_lags, pcf_cutoff_threshold):
+    # A threshold above 1 rejects every row at the Pearson coefficient test
+    rcf, snr_mask, ccf_masked, x_lag = _mock_ccf(24, n_lags)
+    result = compute_estimated_clock_corrections(rcf, snr_mask, ccf_masked, x_lag, pcf_cutoff_threshold)
+    expected = _reference_clock_corrections(rcf, snr_mask, ccf_masked, x_lag, pcf_cutoff_threshold)
+    _assert_corrections_equal(result, expected)
+
+    correction = result[1]
+    assert np.all(np.isnan(correction[[5, 17]]))
+    if pcf_cutoff_threshold > 1:
+        assert np.all(np.isnan(correction))
+    else:
+        assert np.all(np.isnan(correction[[3, 11]]))
+        assert np.sum(np.isfinite(correction)) == 20
+
+
+def test_estimated_clock_corrections_no_rcf():
+    rcf, snr_mask, ccf_masked, x_lag = _mock_ccf(24, 401)
+    result = compute_estimated_clock_corrections(None, snr_mask, ccf_masked, x_lag, 0.5)
+    expected = _reference_clock_corrections(None, snr_mask, ccf_masked, x_lag, 0.5)
+    _assert_corrections_equal(result, expected)
+    assert all(np.all(np.isnan(r)) for r in result)
+
+    # All rows masked out
+    ccf_masked[:] = np.ma.masked
+    result = compute_estimated_clock_corrections(rcf, np.zeros_like(snr_mask), ccf_masked, x_lag, 0.5)
+    expected = _reference_clock_corrections(rcf, np.zeros_like(snr_mask), ccf_masked, x_lag, 0.5)
+    _assert_corrections_equal(result, expected)
+    assert all(np.all(np.isnan(r)) for r in result)